@@ -1,11 +1,14 @@
 from __future__ import annotations
 
 import asyncio
-import json
+import base64
+import logging
 import uuid
-from asyncio import Queue
+from collections import deque
+from contextlib import aclosing
 from dataclasses import dataclass
-from typing import Any, Callable
+from datetime import datetime
+from typing import Any
 
 from anthropic.types.beta import BetaContentBlockParam
 
@@ -15,13 +18,95 @@ from computer_use_demo.loop import (
 )
 from computer_use_demo.tools import ToolResult, ToolVersion
 
-from .db import upsert_message
+from .db import append_history, bulk_upsert_messages, upsert_message
+from .serialization import dumps, pack_frame
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on undelivered events per session
+EVENT_BUFFER_SIZE = 1024
+# Events written to the client per wake-up of a stream
+EVENT_BATCH_LIMIT = 64
+# Pre-encoded SSE frame headers for the events a session emits
+_SSE_PREFIXES = {
+    name: f"event: {name}\ndata: ".encode()
+    for name in ("message", "assistant_chunk", "http_exchange", "turn_error")
+}
 
 
 @dataclass
 class StreamEvent:
     event: str
     data: dict[str, Any]
+    # Tool screenshot, kept out of `data` so only the msgpack stream sends it
+    image_base64: str | None = None
+
+
+def _with_image(event: StreamEvent) -> dict[str, Any]:
+    """Event data with the screenshot added to its tool_result block as raw bytes."""
+    if not event.image_base64:
+        return event.data
+    block, *rest = event.data["content"]
+    image = base64.b64decode(event.image_base64)
+    return {**event.data, "content": [{**block, "image": image}, *rest]}
+
+
+def _coalesce_chunks(batch: list[StreamEvent]) -> list[StreamEvent]:
+    """Merge runs of adjacent assistant_chunk events into one event."""
+    out: list[StreamEvent] = []
+    for event in batch:
+        if event.event == "assistant_chunk" and out and out[-1].event == "assistant_chunk":
+            # Copy rather than extend: the earlier event's list may be shared
+            out[-1] = StreamEvent(
+                event="assistant_chunk",
+                data={"blocks": [*out[-1].data["blocks"], *event.data["blocks"]]},
+            )
+        else:
+            out.append(event)
+    return out
+
+
+class EventBuffer:
+    """Single-producer/single-consumer event ring for one session.
+
+    push() never blocks; once the ring is full the oldest undelivered event
+    is overwritten. The consumer takes everything available per wake-up.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self._items: deque[StreamEvent] = deque(maxlen=maxsize)
+        self._ready = asyncio.Event()
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def push(self, item: StreamEvent) -> None:
+        self._items.append(item)
+        self._ready.set()
+
+    async def pop_batch(self, limit: int) -> list[StreamEvent]:
+        """Wait for events and return up to `limit` of them, oldest first.
+
+        Returns an empty list once the buffer is closed and drained.
+        """
+        while not self._items and not self._closed:
+            self._ready.clear()
+            await self._ready.wait()
+        items = self._items
+        return [items.popleft() for _ in range(min(limit, len(items)))]
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def close(self) -> None:
+        # Wakes waiting consumers; pop_batch() no longer waits for new events
+        self._closed = True
+        self._ready.set()
 
 
 class AgentSession:
@@ -33,6 +118,7 @@ class AgentSession:
         api_key: str,
         system_prompt_suffix: str = "",
         provider: APIProvider = APIProvider.ANTHROPIC,
+        lock: asyncio.Lock | None = None,
     ) -> None:
         self.session_id = session_id
         self.model = model
@@ -41,11 +127,41 @@ class AgentSession:
         self.system_prompt_suffix = system_prompt_suffix
         self.provider = provider
         self.messages: list[dict[str, Any]] = []
-        self.queue: Queue[StreamEvent] = Queue()
-        self.lock = asyncio.Lock()
+        self.events = EventBuffer(EVENT_BUFFER_SIZE)
+        self.lock = lock if lock is not None else asyncio.Lock()
+        # Number of open event streams reading self.events
+        self._streams = 0
+        # Background turns started by start_turn(); kept so they can be cancelled
+        self._tasks: set[asyncio.Task[None]] = set()
+        # User messages being written by add_user_message()
+        self._pending_writes = 0
+        # Leading entries of self.messages already stored by save_history()
+        self._history_saved = 0
 
-    async def _emit(self, event: str, data: dict[str, Any]) -> None:
-        await self.queue.put(StreamEvent(event=event, data=data))
+    @property
+    def in_use(self) -> bool:
+        """True while a turn or user message write is in flight or a client is
+        streaming events; such a runner must not be evicted."""
+        return bool(self._tasks) or self._pending_writes > 0 or self._streams > 0
+
+    def _emit(
+        self, event: str, data: dict[str, Any], image_base64: str | None = None
+    ) -> None:
+        self.events.push(StreamEvent(event=event, data=data, image_base64=image_base64))
+
+    def restore_history(self, messages: list[dict[str, Any]]) -> None:
+        """Resume from history loaded from the DB; it is not stored again."""
+        self.messages = messages
+        self._history_saved = len(messages)
+
+    async def save_history(self) -> None:
+        """Append the entries added to self.messages since the last save."""
+        start = self._history_saved
+        entries = self.messages[start:]
+        if not entries:
+            return
+        await append_history(self.session_id, start, entries)
+        self._history_saved = start + len(entries)
 
     async def add_user_message(self, content: str) -> None:
         message_id = str(uuid.uuid4())
@@ -54,16 +170,72 @@ class AgentSession:
             "role": "user",
             "content": [{"type": "text", "text": content}],
         }
-        self.messages.append(msg)
-        await upsert_message(message_id, self.session_id, "user", msg)
-        await self._emit("message", msg)
+        self._pending_writes += 1
+        try:
+            self.messages.append(msg)
+            await upsert_message(message_id, self.session_id, "user", msg)
+            self._emit("message", msg)
+        finally:
+            self._pending_writes -= 1
+
+    def start_turn(self) -> asyncio.Task[None]:
+        """Schedule run_once() in the background and track the task."""
+        task = asyncio.create_task(self.run_once())
+        self._tasks.add(task)
+        task.add_done_callback(self._turn_done)
+        return task
+
+    def _turn_done(self, task: asyncio.Task[None]) -> None:
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None:
+            # Nobody awaits the task: report the failure here and to the client
+            logger.error("Turn failed in session %s", self.session_id, exc_info=exc)
+            self._emit("turn_error", {"error": str(exc) or type(exc).__name__})
+
+    async def cancel(self) -> None:
+        """Cancel in-flight turns and wait for them to finish cleaning up."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def persist_and_close(self) -> None:
+        """Release the runner: stop running turns (which flushes their pending
+        messages to the DB), store the rest of its history, drop undelivered
+        events and end open streams so their clients reconnect to a fresh
+        runner."""
+        await self.cancel()
+        try:
+            await self.save_history()
+        except Exception:
+            logger.exception("Failed to save history of session %s", self.session_id)
+        self.events.clear()
+        self.events.close()
 
     async def run_once(self) -> None:
         async with self.lock:
-            async def on_output(block: BetaContentBlockParam) -> None:
-                await self._emit("assistant_chunk", {"block": block})
+            # Tool/assistant rows are written in one batch at the end of the turn;
+            # SSE events are still emitted per message.
+            pending: list[dict[str, Any]] = []
+
+            def persist_later(message_id: str, role: str, content: dict[str, Any]) -> None:
+                pending.append(
+                    {
+                        "id": message_id,
+                        "session_id": self.session_id,
+                        "role": role,
+                        "content": content,
+                        "created_at": datetime.utcnow(),
+                    }
+                )
+
+            def on_output(block: BetaContentBlockParam) -> None:
+                self._emit("assistant_chunk", {"blocks": [block]})
 
-            async def on_tool_output(result: ToolResult, tool_id: str) -> None:  # type: ignore[override]
+            def on_tool_output(result: ToolResult, tool_id: str) -> None:
                 payload = {
                     "type": "tool_result",
                     "tool_use_id": tool_id,
@@ -78,11 +250,11 @@ class AgentSession:
                     "role": "tool",
                     "content": [payload],
                 }
-                await upsert_message(message_id, self.session_id, "tool", tool_msg)
-                await self._emit("message", tool_msg)
+                persist_later(message_id, "tool", tool_msg)
+                self._emit("message", tool_msg, image_base64=result.base64_image)
 
-            async def on_api_response(req, res, err):  # noqa: ANN001
-                await self._emit(
+            def on_api_response(req, res, err):  # noqa: ANN001
+                self._emit(
                     "http_exchange",
                     {
                         "request": str(req),
@@ -91,36 +263,83 @@ class AgentSession:
                     },
                 )
 
-            # run a single assistant turn
-            new_messages = await sampling_loop(
-                system_prompt_suffix=self.system_prompt_suffix,
-                model=self.model,
-                provider=self.provider,
-                messages=self.messages,
-                output_callback=lambda block: asyncio.create_task(on_output(block)),
-                tool_output_callback=lambda result, tool_id: asyncio.create_task(
-                    on_tool_output(result, tool_id)
-                ),
-                api_response_callback=lambda req, res, err: asyncio.create_task(
-                    on_api_response(req, res, err)
-                ),
-                api_key=self.api_key,
-                tool_version=self.tool_version,
-                max_tokens=4096,
-            )
+            try:
+                # run a single assistant turn
+                new_messages = await sampling_loop(
+                    system_prompt_suffix=self.system_prompt_suffix,
+                    model=self.model,
+                    provider=self.provider,
+                    messages=self.messages,
+                    output_callback=on_output,
+                    tool_output_callback=on_tool_output,
+                    api_response_callback=on_api_response,
+                    api_key=self.api_key,
+                    tool_version=self.tool_version,
+                    max_tokens=4096,
+                )
 
-            # Persist the assistant message (the last message added by sampling_loop)
-            if new_messages and new_messages[-1]["role"] == "assistant":
-                assistant = new_messages[-1]
-                message_id = str(uuid.uuid4())
-                await upsert_message(message_id, self.session_id, "assistant", assistant)
-                await self._emit("message", {"id": message_id, **assistant})
-            self.messages = new_messages
+                # Persist the assistant message (the last message added by sampling_loop)
+                if new_messages and new_messages[-1]["role"] == "assistant":
+                    assistant = new_messages[-1]
+                    message_id = str(uuid.uuid4())
+                    persist_later(message_id, "assistant", assistant)
+                    self._emit("message", {"id": message_id, **assistant})
+                # sampling_loop appends to the list it was given; only pick up a tail
+                # if it ever hands back a different list
+                if new_messages is not self.messages:
+                    self.messages.extend(new_messages[len(self.messages) :])
+            except BaseException:
+                # Still store what the turn produced, but report the turn's own
+                # error rather than a failed flush
+                try:
+                    await self._flush(pending)
+                except Exception:
+                    logger.exception(
+                        "Failed to persist messages of session %s", self.session_id
+                    )
+                raise
+            await self._flush(pending)
 
-    async def sse_iter(self):
-        while True:
-            event = await self.queue.get()
-            payload = f"event: {event.event}\n" f"data: {json.dumps(event.data)}\n\n"
-            yield payload
+    async def _flush(self, pending: list[dict[str, Any]]) -> None:
+        await bulk_upsert_messages(pending, self.session_id)
+        await self.save_history()
+
+    async def _event_batches(self):
+        # Streams share the session's buffer; each event goes to one of them
+        if self.events.closed:
+            return
+        self._streams += 1
+        try:
+            while True:
+                batch = await self.events.pop_batch(EVENT_BATCH_LIMIT)
+                if not batch:
+                    # Runner was closed
+                    return
+                yield _coalesce_chunks(batch)
+        finally:
+            self._streams -= 1
+            if not self._streams:
+                # Last client went away: release undelivered events
+                self.events.clear()
 
+    async def sse_iter(self):
+        # Yields ready-made SSE frames, one write per batch; EventSourceResponse
+        # passes bytes through. aclosing: when the client goes away,
+        # _event_batches() is closed right away too
+        async with aclosing(self._event_batches()) as batches:
+            async for batch in batches:
+                frames = []
+                for event in batch:
+                    prefix = _SSE_PREFIXES.get(event.event)
+                    if prefix is None:
+                        prefix = f"event: {event.event}\ndata: ".encode()
+                    frames.append(prefix + dumps(event.data) + b"\n\n")
+                yield b"".join(frames)
 
+    async def msgpack_iter(self):
+        async with aclosing(self._event_batches()) as batches:
+            async for batch in batches:
+                yield b"".join(
+                    pack_frame({"event": event.event, "data": _with_image(event)})
+                    for event in batch
+                )
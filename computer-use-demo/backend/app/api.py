@@ -3,17 +3,25 @@ from __future__ import annotations
 import os
 import uuid
 from datetime import datetime
-import asyncio
 from typing import Annotated
 
-from fastapi import Depends, FastAPI, HTTPException, Request
+import orjson
+from fastapi import Depends, FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from sse_starlette.sse import EventSourceResponse
 
 from computer_use_demo.tools import ToolVersion
 
 from .agent_runner import AgentSession
-from .db import create_session, get_messages, get_session, list_sessions, init_engine
+from .db import (
+    create_session,
+    get_history,
+    get_messages,
+    get_session,
+    init_engine,
+    list_sessions,
+)
 from .models import (
     ChatMessage,
     SendMessageRequest,
@@ -21,6 +29,9 @@ from .models import (
     SessionCreateRequest,
     SessionSummary,
 )
+from .serialization import ORJSONResponse, dumps
+from .session_cache import SessionCache, session_lock
+from .settings import get_max_active_sessions
 
 
 def get_api_key() -> str:
@@ -30,7 +41,11 @@ def get_api_key() -> str:
     return api_key
 
 
-app = FastAPI(title="Computer Use Backend", version="0.1.0")
+app = FastAPI(
+    title="Computer Use Backend",
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -39,8 +54,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory sessions runtime map (id -> AgentSession). Persistence is in SQLite.
-SESSIONS: dict[str, AgentSession] = {}
+# In-memory LRU of live sessions (id -> AgentSession). Persistence is in the DB;
+# evicted sessions are rebuilt from their stored history on demand.
+SESSIONS = SessionCache(maxsize=get_max_active_sessions())
+
+
+async def _get_runner(session_id: str) -> AgentSession:
+    runner = SESSIONS.get(session_id)
+    if runner is not None:
+        return runner
+    lock = session_lock(session_id)
+    async with lock:
+        # Another request may have rehydrated the session while we waited
+        runner = SESSIONS.get(session_id)
+        if runner is not None:
+            return runner
+        row = await get_session(session_id)
+        if not row:
+            raise HTTPException(404, "Session not found")
+        runner = AgentSession(
+            session_id=session_id,
+            model=row["model"],
+            tool_version=row["tool_version"],
+            api_key=get_api_key(),
+            system_prompt_suffix=row["system_prompt_suffix"],
+            lock=lock,
+        )
+        history = [orjson.loads(entry) async for entry in get_history(session_id)]
+        if history:
+            runner.restore_history(history)
+        else:
+            # Stored before session_history existed: fall back to the UI rows,
+            # which lack the intermediate tool_use/tool_result turns
+            runner.messages = [
+                orjson.loads(msg["content"])
+                async for msg in get_messages(session_id)
+                if msg["role"] != "tool"
+            ]
+        await SESSIONS.put(session_id, runner)
+        return runner
 
 
 @app.on_event("startup")
@@ -64,8 +116,9 @@ async def create_new_session(body: SessionCreateRequest, api_key: Annotated[str,
         tool_version=body.tool_version,  # type: ignore[arg-type]
         api_key=api_key,
         system_prompt_suffix=body.system_prompt_suffix,
+        lock=session_lock(session_id),
     )
-    SESSIONS[session_id] = runner
+    await SESSIONS.put(session_id, runner)
     row = await get_session(session_id)
     if not row:
         raise HTTPException(500, "Session creation failed")
@@ -79,73 +132,85 @@ async def create_new_session(body: SessionCreateRequest, api_key: Annotated[str,
     )
 
 
-@app.get("/sessions", response_model=list[SessionSummary])
+@app.get("/sessions", responses={200: {"model": list[SessionSummary]}})
 async def list_all_sessions():
     rows = await list_sessions()
-    return [
-        SessionSummary(
-            id=row["id"],
-            model=row["model"],
-            created_at=row["created_at"],
-            updated_at=row["updated_at"],
-        )
+    payload = [
+        {
+            "id": row["id"],
+            "model": row["model"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
         for row in rows
     ]
+    return Response(content=dumps(payload), media_type="application/json")
 
 
-@app.get("/sessions/{session_id}", response_model=Session)
+@app.get("/sessions/{session_id}", responses={200: {"model": Session}})
 async def get_session_by_id(session_id: str):
     row = await get_session(session_id)
     if not row:
         raise HTTPException(404, "Session not found")
-    return Session(
-        id=row["id"],
-        model=row["model"],
-        tool_version=row["tool_version"],
-        system_prompt_suffix=row["system_prompt_suffix"],
-        created_at=row["created_at"],
-        updated_at=row["updated_at"],
-    )
+    payload = {
+        "id": row["id"],
+        "model": row["model"],
+        "tool_version": row["tool_version"],
+        "system_prompt_suffix": row["system_prompt_suffix"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+    return Response(content=dumps(payload), media_type="application/json")
+
+
+async def _messages_json_array(session_id: str):
+    # Emit the array incrementally so only one row is serialized at a time.
+    # `content` is already JSON text in the DB and is spliced in as-is.
+    yield b"["
+    first = True
+    async for row in get_messages(session_id):
+        item = (
+            b'{"id":'
+            + dumps(row["id"])
+            + b',"role":'
+            + dumps(row["role"])
+            + b',"content":'
+            + row["content"].encode()
+            + b',"created_at":'
+            + dumps(row["created_at"])
+            + b"}"
+        )
+        yield item if first else b"," + item
+        first = False
+    yield b"]"
 
 
-@app.get("/sessions/{session_id}/messages", response_model=list[ChatMessage])
+@app.get("/sessions/{session_id}/messages", responses={200: {"model": list[ChatMessage]}})
 async def get_session_messages(session_id: str):
-    rows = await get_messages(session_id)
-    return [
-        ChatMessage(
-            id=row["id"],
-            role=row["role"],
-            content=row["content"],
-            created_at=row["created_at"],
-        )
-        for row in rows
-    ]
+    return StreamingResponse(_messages_json_array(session_id), media_type="application/json")
 
 
 @app.get("/sessions/{session_id}/events")
-async def session_events(session_id: str, request: Request):
-    runner = SESSIONS.get(session_id)
-    if not runner:
-        raise HTTPException(404, "Session not active")
+async def session_events(session_id: str):
+    runner = await _get_runner(session_id)
+
+    # EventSourceResponse sends keep-alive pings and stops the iterator on disconnect
+    return EventSourceResponse(runner.sse_iter())
 
-    async def event_stream():
-        async for payload in runner.sse_iter():
-            # Client disconnect handling
-            if await request.is_disconnected():
-                break
-            yield payload
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+@app.get("/sessions/{session_id}/events.msgpack")
+async def session_events_msgpack(session_id: str):
+    runner = await _get_runner(session_id)
+    # Length-prefixed msgpack frames; image bytes travel as msgpack bin
+    return StreamingResponse(runner.msgpack_iter(), media_type="application/x-msgpack")
 
 
 @app.post("/sessions/{session_id}/messages")
 async def send_message(session_id: str, body: SendMessageRequest):
-    runner = SESSIONS.get(session_id)
-    if not runner:
-        raise HTTPException(404, "Session not active")
+    runner = await _get_runner(session_id)
     await runner.add_user_message(body.content)
     # Kick off one assistant turn, do not block the request
-    asyncio.create_task(runner.run_once())
+    runner.start_turn()
     return JSONResponse({"status": "queued"})
 
 
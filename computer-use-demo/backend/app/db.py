@@ -1,8 +1,8 @@
 from __future__ import annotations
 
 import json
+from collections.abc import AsyncIterator, Iterable
 from datetime import datetime
-from typing import Iterable
 
 from sqlalchemy import (
     JSON,
@@ -10,19 +10,51 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Index,
+    Integer,
     MetaData,
     String,
     Table,
     Text,
+    TypeDecorator,
+    bindparam,
+    event,
+    inspect,
+    lambda_stmt,
     select,
+    text,
     update,
 )
-from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.pool import StaticPool
 
+from .serialization import dumps
 from .settings import get_database_url
 
 
+class OrjsonText(TypeDecorator):
+    """JSON stored as text; reads return the raw JSON string without decoding."""
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):  # noqa: ANN001
+        if value is None:
+            return None
+        return dumps(value).decode()
+
+    def process_result_value(self, value, dialect):  # noqa: ANN001
+        if value is None or isinstance(value, str):
+            return value
+        # Drivers that still hand back decoded JSON (e.g. a legacy json column)
+        return dumps(value).decode()
+
+
 metadata = MetaData()
 
 sessions_table = Table(
@@ -42,15 +74,88 @@ messages_table = Table(
     Column("id", String, primary_key=True),
     Column("session_id", String, ForeignKey("sessions.id", ondelete="CASCADE"), nullable=False),
     Column("role", String, nullable=False),
-    Column("content", JSON, nullable=False),
+    Column("content", OrjsonText, nullable=False),
     Column("created_at", DateTime(timezone=False), nullable=False),
 )
 
 Index("idx_messages_session", messages_table.c.session_id, messages_table.c.created_at)
 
+# The conversation as sampling_loop sees it, one row per entry. messages only
+# keeps what the UI shows, not the intermediate tool_use/tool_result turns.
+history_table = Table(
+    "session_history",
+    metadata,
+    Column("session_id", String, ForeignKey("sessions.id", ondelete="CASCADE"), primary_key=True),
+    Column("seq", Integer, primary_key=True),
+    Column("content", OrjsonText, nullable=False),
+)
+
+# Hot statements are built once and cached compiled; per-call values are bound
+_GET_SESSION = lambda_stmt(
+    lambda: select(sessions_table).where(sessions_table.c.id == bindparam("session_id"))
+)
+_GET_MESSAGES = lambda_stmt(
+    lambda: select(messages_table)
+    .where(messages_table.c.session_id == bindparam("session_id"))
+    .order_by(messages_table.c.created_at.asc())
+)
+_INSERT_MESSAGE = messages_table.insert()
+_GET_HISTORY = lambda_stmt(
+    lambda: select(history_table.c.content)
+    .where(history_table.c.session_id == bindparam("session_id"))
+    .order_by(history_table.c.seq.asc())
+)
+_INSERT_HISTORY = history_table.insert()
+_TOUCH_SESSION = (
+    update(sessions_table)
+    .where(sessions_table.c.id == bindparam("session_id"))
+    .values(updated_at=bindparam("now"))
+)
+
 
 async_engine: AsyncEngine | None = None
-AsyncSessionLocal: sessionmaker | None = None
+AsyncSessionLocal: async_sessionmaker[AsyncSession] | None = None
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # WAL + synchronous=NORMAL avoids an fsync per committed message
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def _engine_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        options: dict = {"connect_args": {"check_same_thread": False, "timeout": 30}}
+        if make_url(url).database in (None, "", ":memory:"):
+            # An in-memory DB only exists on its connection, so share a single one
+            options["poolclass"] = StaticPool
+        return options
+    # Server databases: enough connections for concurrent sessions writing messages
+    return {
+        "pool_size": 20,
+        "max_overflow": 40,
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
+
+
+def _migrate_message_content(connection) -> None:
+    # messages.content was a json column before OrjsonText. create_all does not
+    # alter existing tables, and Postgres has no assignment cast from varchar
+    # to json, so inserts into an old table would fail.
+    if connection.dialect.name != "postgresql":
+        return
+    columns = {
+        column["name"]: column["type"]
+        for column in inspect(connection).get_columns("messages")
+    }
+    if isinstance(columns.get("content"), JSON):
+        connection.execute(
+            text("ALTER TABLE messages ALTER COLUMN content TYPE text USING content::text")
+        )
 
 
 async def init_engine() -> None:
@@ -58,11 +163,14 @@ async def init_engine() -> None:
     if async_engine is not None:
         return
     url = get_database_url()
-    async_engine = create_async_engine(url, future=True, echo=False)
-    AsyncSessionLocal = sessionmaker(async_engine, expire_on_commit=False, class_=AsyncSession)
+    async_engine = create_async_engine(url, future=True, echo=False, **_engine_options(url))
+    if url.startswith("sqlite"):
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
     # Create tables
     async with async_engine.begin() as conn:
         await conn.run_sync(metadata.create_all)
+        await conn.run_sync(_migrate_message_content)
 
 
 async def create_session(session_id: str, model: str, tool_version: str, system_suffix: str) -> None:
@@ -84,22 +192,56 @@ async def create_session(session_id: str, model: str, tool_version: str, system_
 
 async def upsert_message(message_id: str, session_id: str, role: str, content: dict) -> None:
     assert AsyncSessionLocal is not None
-    async with AsyncSessionLocal() as session:
+    now = datetime.utcnow()
+    async with AsyncSessionLocal.begin() as session:
         await session.execute(
-            messages_table.insert().values(
-                id=message_id,
-                session_id=session_id,
-                role=role,
-                content=content,
-                created_at=datetime.utcnow(),
-            )
+            _INSERT_MESSAGE,
+            {
+                "id": message_id,
+                "session_id": session_id,
+                "role": role,
+                "content": content,
+                "created_at": now,
+            },
         )
-        await session.execute(
-            update(sessions_table)
-            .where(sessions_table.c.id == session_id)
-            .values(updated_at=datetime.utcnow())
+        await session.execute(_TOUCH_SESSION, {"session_id": session_id, "now": now})
+
+
+async def bulk_upsert_messages(rows: list[dict], session_id: str) -> None:
+    """Insert several messages of one session with a single executemany."""
+    assert AsyncSessionLocal is not None
+    if not rows:
+        return
+    now = datetime.utcnow()
+    async with AsyncSessionLocal.begin() as session:
+        await session.execute(_INSERT_MESSAGE, rows)
+        await session.execute(_TOUCH_SESSION, {"session_id": session_id, "now": now})
+
+
+async def append_history(session_id: str, start: int, entries: list[dict]) -> None:
+    """Store entries as positions start, start + 1, ... of a session's history."""
+    assert AsyncSessionLocal is not None
+    if not entries:
+        return
+    rows = [
+        {"session_id": session_id, "seq": start + i, "content": entry}
+        for i, entry in enumerate(entries)
+    ]
+    async with AsyncSessionLocal.begin() as session:
+        await session.execute(_INSERT_HISTORY, rows)
+
+
+async def get_history(session_id: str) -> AsyncIterator[str]:
+    """Yield a session's history entries in order, as raw JSON text."""
+    assert AsyncSessionLocal is not None
+    async with AsyncSessionLocal() as session:
+        res = await session.stream(
+            _GET_HISTORY,
+            {"session_id": session_id},
+            execution_options={"yield_per": 256},
         )
-        await session.commit()
+        async for content in res.scalars():
+            yield content
 
 
 async def list_sessions() -> Iterable[dict]:
@@ -119,19 +261,19 @@ async def list_sessions() -> Iterable[dict]:
 async def get_session(session_id: str) -> dict | None:
     assert AsyncSessionLocal is not None
     async with AsyncSessionLocal() as session:
-        res = await session.execute(
-            select(sessions_table).where(sessions_table.c.id == session_id)
-        )
+        res = await session.execute(_GET_SESSION, {"session_id": session_id})
         row = res.first()
         return dict(row._mapping) if row else None
 
 
-async def get_messages(session_id: str) -> list[dict]:
+async def get_messages(session_id: str) -> AsyncIterator[dict]:
+    """Yield a session's messages oldest first, streamed from a server-side cursor."""
     assert AsyncSessionLocal is not None
     async with AsyncSessionLocal() as session:
-        res = await session.execute(
-            select(messages_table).where(messages_table.c.session_id == session_id).order_by(messages_table.c.created_at.asc())
+        res = await session.stream(
+            _GET_MESSAGES,
+            {"session_id": session_id},
+            execution_options={"yield_per": 256},
         )
-        return [dict(r._mapping) for r in res]
-
-
+        async for row in res.mappings():
+            yield dict(row)
@@ -18,7 +18,8 @@ class MessageBlock(BaseModel):
 class ChatMessage(BaseModel):
     id: str
     role: Literal["user", "assistant", "tool"]
-    content: list[MessageBlock] | str
+    # Stored message as written by the backend; returned without re-validation
+    content: Any
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
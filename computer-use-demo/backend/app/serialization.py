@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import base64
+from datetime import datetime
+from typing import Any
+
+import msgpack
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+
+def orjson_default(obj: Any) -> Any:
+    # Fallback for types orjson does not serialize natively
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, bytes | bytearray | memoryview):
+        return base64.b64encode(obj).decode("ascii")
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=orjson_default)
+
+
+def _msgpack_default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Type is not msgpack serializable: {type(obj).__name__}")
+
+
+def pack_frame(obj: Any) -> bytes:
+    """msgpack-encode obj, prefixed with its 4-byte big-endian length.
+
+    bytes values are written as msgpack bin, without base64.
+    """
+    payload = msgpack.packb(obj, use_bin_type=True, default=_msgpack_default)
+    return len(payload).to_bytes(4, "big") + payload
+
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import asyncio
+import weakref
+from collections import OrderedDict
+
+from .agent_runner import AgentSession
+
+# One lock per session id, alive only while a runner (or a waiter) references it
+_LOCKS: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+
+def session_lock(session_id: str) -> asyncio.Lock:
+    lock = _LOCKS.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _LOCKS[session_id] = lock
+    return lock
+
+
+class SessionCache:
+    """LRU of live AgentSessions.
+
+    Evicted runners store their model history in the DB and are closed; the
+    history is loaded again the next time the session is used. Runners that are in use
+    (running a turn or streaming to a client) are skipped, so the cache can
+    exceed maxsize until they go idle.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._runners: OrderedDict[str, AgentSession] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._runners)
+
+    def __contains__(self, session_id: object) -> bool:
+        return session_id in self._runners
+
+    def get(self, session_id: str) -> AgentSession | None:
+        runner = self._runners.get(session_id)
+        if runner is not None:
+            self._runners.move_to_end(session_id)
+        return runner
+
+    async def put(self, session_id: str, runner: AgentSession) -> None:
+        self._runners[session_id] = runner
+        self._runners.move_to_end(session_id)
+        # Oldest first; the runner just inserted is never a candidate
+        for candidate_id in list(self._runners)[:-1]:
+            if len(self._runners) <= self.maxsize:
+                break
+            candidate = self._runners.get(candidate_id)
+            if candidate is None or candidate.in_use:
+                continue
+            del self._runners[candidate_id]
+            await candidate.persist_and_close()
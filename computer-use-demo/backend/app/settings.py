@@ -12,3 +12,15 @@ def get_database_url() -> str:
     return url
 
 
+def get_max_active_sessions() -> int:
+    # Number of sessions kept in memory; older ones are reloaded from the DB on use
+    value = int(os.getenv("MAX_ACTIVE_SESSIONS", "256"))
+    if value < 1:
+        raise ValueError("MAX_ACTIVE_SESSIONS must be at least 1")
+    return value
+
+
+def get_server_workers() -> int:
+    # Live sessions are held in process memory, so more than one worker needs
+    # sticky routing by session id in front of the backend
+    return max(1, int(os.getenv("WORKERS", "1")))
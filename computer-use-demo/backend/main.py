@@ -2,14 +2,22 @@ from __future__ import annotations
 
 import uvicorn
 
-from app.api import app
+from app.settings import get_server_workers
 
 
 def run():
-    uvicorn.run(app, host="0.0.0.0", port=8080, reload=False)
+    uvicorn.run(
+        "app.api:app",
+        host="0.0.0.0",
+        port=8080,
+        reload=False,
+        workers=get_server_workers(),
+        loop="uvloop",
+        http="httptools",
+        log_level="warning",
+        access_log=False,
+    )
 
 
 if __name__ == "__main__":
     run()
-
-
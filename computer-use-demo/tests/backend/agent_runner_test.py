@@ -0,0 +1,199 @@
+import asyncio
+import base64
+
+import msgpack
+import orjson
+import pytest
+
+from backend.app import agent_runner
+from backend.app.agent_runner import AgentSession
+
+
+@pytest.fixture
+def runner():
+    return AgentSession(
+        session_id="session",
+        model="claude-sonnet-4-20250514",
+        tool_version="computer_use_20250124",
+        api_key="test-key",
+    )
+
+
+def test_emit_without_client_overwrites_oldest(runner):
+    total = agent_runner.EVENT_BUFFER_SIZE + 10
+    for i in range(total):
+        runner._emit("message", {"i": i})
+
+    assert len(runner.events) == agent_runner.EVENT_BUFFER_SIZE
+    assert runner.events._items[0].data == {"i": 10}
+
+
+async def test_persist_and_close_ends_open_streams(runner):
+    stream = runner.sse_iter()
+    next_event = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0)
+    assert runner.in_use
+
+    await runner.persist_and_close()
+
+    with pytest.raises(StopAsyncIteration):
+        await asyncio.wait_for(next_event, timeout=1)
+    assert not runner.in_use
+    # Streams opened on a closed runner end immediately
+    with pytest.raises(StopAsyncIteration):
+        await runner.sse_iter().__anext__()
+
+
+async def test_screenshot_is_only_sent_on_the_msgpack_stream(runner):
+    image = b"\x89PNG\r\n"
+    message = {
+        "id": "m1",
+        "role": "tool",
+        "content": [{"type": "tool_result", "tool_use_id": "t1", "has_image": True}],
+    }
+
+    runner._emit("message", message, image_base64=base64.b64encode(image).decode())
+    sse_stream = runner.sse_iter()
+    sse_frame = await sse_stream.__anext__()
+    await sse_stream.aclose()
+
+    runner._emit("message", message, image_base64=base64.b64encode(image).decode())
+    msgpack_stream = runner.msgpack_iter()
+    frame = await msgpack_stream.__anext__()
+    await msgpack_stream.aclose()
+
+    assert sse_frame == b"event: message\ndata: " + orjson.dumps(message) + b"\n\n"
+    block = msgpack.unpackb(frame[4:])["data"]["content"][0]
+    assert block["image"] == image
+    assert block["tool_use_id"] == "t1"
+
+
+def _event(i):
+    return agent_runner.StreamEvent(event="message", data={"i": i})
+
+
+async def test_event_buffer_overwrites_oldest_when_full():
+    events = agent_runner.EventBuffer(3)
+    for i in range(5):
+        events.push(_event(i))
+
+    assert len(events) == 3
+    batch = await events.pop_batch(10)
+    assert [event.data["i"] for event in batch] == [2, 3, 4]
+
+
+async def test_event_buffer_pop_batch_respects_limit():
+    events = agent_runner.EventBuffer(10)
+    for i in range(5):
+        events.push(_event(i))
+
+    first = await events.pop_batch(2)
+    rest = await events.pop_batch(10)
+
+    assert [event.data["i"] for event in first] == [0, 1]
+    assert [event.data["i"] for event in rest] == [2, 3, 4]
+
+
+async def test_event_buffer_push_wakes_waiting_consumer():
+    events = agent_runner.EventBuffer(10)
+    batch = asyncio.ensure_future(events.pop_batch(10))
+    await asyncio.sleep(0)
+    assert not batch.done()
+
+    events.push(_event(0))
+
+    assert [event.data["i"] for event in await asyncio.wait_for(batch, 1)] == [0]
+
+
+async def test_event_buffer_clear_then_close_ends_consumer():
+    events = agent_runner.EventBuffer(10)
+    events.push(_event(0))
+    events.clear()
+    assert len(events) == 0
+
+    batch = asyncio.ensure_future(events.pop_batch(10))
+    await asyncio.sleep(0)
+    assert not batch.done()
+    events.close()
+
+    assert await asyncio.wait_for(batch, 1) == []
+    assert events.closed
+
+
+def _chunk(text):
+    return agent_runner.StreamEvent(
+        event="assistant_chunk", data={"blocks": [{"type": "text", "text": text}]}
+    )
+
+
+def test_coalesce_chunks_merges_only_adjacent_chunks():
+    batch = [_chunk("a"), _chunk("b"), _event(0), _chunk("c"), _chunk("d")]
+
+    merged = agent_runner._coalesce_chunks(batch)
+
+    assert [event.event for event in merged] == [
+        "assistant_chunk",
+        "message",
+        "assistant_chunk",
+    ]
+    assert [block["text"] for block in merged[0].data["blocks"]] == ["a", "b"]
+    assert merged[1] is batch[2]
+    assert [block["text"] for block in merged[2].data["blocks"]] == ["c", "d"]
+
+
+def test_coalesce_chunks_leaves_input_events_untouched():
+    first, second = _chunk("a"), _chunk("b")
+
+    agent_runner._coalesce_chunks([first, second])
+
+    assert [block["text"] for block in first.data["blocks"]] == ["a"]
+    assert [block["text"] for block in second.data["blocks"]] == ["b"]
+
+
+async def test_flush_failure_does_not_replace_the_turn_error(runner, monkeypatch):
+    async def failing_sampling_loop(**kwargs):
+        raise RuntimeError("API error")
+
+    async def failing_flush(rows, session_id):
+        raise OSError("database is down")
+
+    monkeypatch.setattr(agent_runner, "sampling_loop", failing_sampling_loop)
+    monkeypatch.setattr(agent_runner, "bulk_upsert_messages", failing_flush)
+
+    with pytest.raises(RuntimeError, match="API error"):
+        await runner.run_once()
+
+
+async def test_failed_turn_is_logged_and_reported_to_the_client(
+    runner, monkeypatch, caplog
+):
+    async def failing_run_once():
+        raise RuntimeError("tool crashed")
+
+    monkeypatch.setattr(runner, "run_once", failing_run_once)
+
+    task = runner.start_turn()
+    with pytest.raises(RuntimeError):
+        await task
+    await asyncio.sleep(0)
+
+    assert not runner.in_use
+    assert "Turn failed in session session" in caplog.text
+    (event,) = await runner.events.pop_batch(10)
+    assert event.event == "turn_error"
+    assert event.data == {"error": "tool crashed"}
+
+
+async def test_cancelled_turn_is_not_reported(runner, monkeypatch):
+    async def slow_run_once():
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(runner, "run_once", slow_run_once)
+
+    runner.start_turn()
+    await asyncio.sleep(0)
+    await runner.cancel()
+    await asyncio.sleep(0)
+
+    assert not runner.in_use
+    assert len(runner.events) == 0
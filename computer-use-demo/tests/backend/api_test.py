@@ -0,0 +1,93 @@
+import orjson
+import pytest
+
+from backend.app import agent_runner, api
+from backend.app.models import SessionCreateRequest
+from backend.app.session_cache import SessionCache
+from computer_use_demo.tools import ToolResult
+
+
+async def tool_using_sampling_loop(*, messages, tool_output_callback, **kwargs):
+    # Mirrors sampling_loop: every turn is appended to the list it was given
+    messages.append(
+        {
+            "role": "assistant",
+            "content": [
+                {
+                    "type": "tool_use",
+                    "id": "t1",
+                    "name": "bash",
+                    "input": {"command": "ls"},
+                }
+            ],
+        }
+    )
+    tool_output_callback(ToolResult(output="file.txt"), "t1")
+    messages.append(
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": "t1",
+                    "content": [{"type": "text", "text": "file.txt"}],
+                }
+            ],
+        }
+    )
+    messages.append(
+        {"role": "assistant", "content": [{"type": "text", "text": "Done."}]}
+    )
+    return messages
+
+
+@pytest.fixture
+def sessions(database, monkeypatch):
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+    monkeypatch.setattr(agent_runner, "sampling_loop", tool_using_sampling_loop)
+    cache = SessionCache(maxsize=1)
+    monkeypatch.setattr(api, "SESSIONS", cache)
+    return cache
+
+
+async def test_evicted_session_is_rebuilt_with_its_tool_turns(sessions):
+    session = await api.create_new_session(SessionCreateRequest(), api_key="test-key")
+    runner = await api._get_runner(session.id)
+    await runner.add_user_message("List the files")
+    await runner.start_turn()
+    expected = orjson.loads(orjson.dumps(runner.messages))
+    assert [message["role"] for message in expected] == [
+        "user",
+        "assistant",
+        "user",
+        "assistant",
+    ]
+
+    # A second session pushes the first one out of the cache
+    await api.create_new_session(SessionCreateRequest(), api_key="test-key")
+    assert session.id not in sessions
+
+    rebuilt = await api._get_runner(session.id)
+
+    assert rebuilt is not runner
+    assert rebuilt.messages == expected
+
+    # The rebuilt runner keeps appending after the stored history
+    await rebuilt.add_user_message("And again")
+    await rebuilt.start_turn()
+    await api.create_new_session(SessionCreateRequest(), api_key="test-key")
+    again = await api._get_runner(session.id)
+    assert again.messages == orjson.loads(orjson.dumps(rebuilt.messages))
+    assert len(again.messages) == 8
+
+
+async def test_runner_closed_mid_conversation_saves_unflushed_history(sessions):
+    session = await api.create_new_session(SessionCreateRequest(), api_key="test-key")
+    runner = await api._get_runner(session.id)
+    await runner.add_user_message("List the files")
+
+    # No turn has run, so only eviction writes the user message to the history
+    await api.create_new_session(SessionCreateRequest(), api_key="test-key")
+    rebuilt = await api._get_runner(session.id)
+
+    assert [message["role"] for message in rebuilt.messages] == ["user"]
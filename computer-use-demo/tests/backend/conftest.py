@@ -0,0 +1,13 @@
+import pytest
+
+from backend.app import db
+
+
+@pytest.fixture
+async def database(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path / 'app.db'}")
+    monkeypatch.setattr(db, "async_engine", None)
+    monkeypatch.setattr(db, "AsyncSessionLocal", None)
+    await db.init_engine()
+    yield
+    await db.async_engine.dispose()
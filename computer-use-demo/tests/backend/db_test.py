@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from sqlalchemy import JSON, Text, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backend.app import agent_runner, db
+from backend.app.agent_runner import AgentSession
+from backend.app.db import OrjsonText, messages_table, metadata, sessions_table
+from computer_use_demo.tools import ToolResult
+
+NOW = datetime(2025, 1, 1)
+
+
+def test_orjson_text_binds_json_and_reads_raw_text():
+    column_type = OrjsonText()
+    content = {"role": "user", "content": [{"type": "text", "text": "hi"}]}
+
+    stored = column_type.process_bind_param(content, dialect=None)
+
+    assert orjson.loads(stored) == content
+    assert column_type.process_result_value(stored, dialect=None) == stored
+    assert column_type.process_bind_param(None, dialect=None) is None
+
+
+def test_orjson_text_reencodes_values_decoded_by_the_driver():
+    column_type = OrjsonText()
+
+    raw = column_type.process_result_value({"a": [1, 2]}, dialect=None)
+
+    assert raw == '{"a":[1,2]}'
+
+
+def test_message_insert_binds_json_text_on_postgres():
+    dialect = postgresql.psycopg.dialect()
+    content = {"role": "user", "content": [{"type": "text", "text": "hi"}]}
+    compiled = db._INSERT_MESSAGE.compile(dialect=dialect)
+    process = messages_table.c.content.type.bind_processor(dialect)
+
+    bound = process(content)
+
+    # Bound as text, so the column has to be text too (see below)
+    assert "%(content)s::VARCHAR" in str(compiled)
+    assert isinstance(bound, str)
+    assert orjson.loads(bound) == content
+
+
+class FakeConnection:
+    def __init__(self, dialect_name, content_type) -> None:
+        self.dialect = SimpleNamespace(name=dialect_name)
+        self.columns = [
+            {"name": "id", "type": Text()},
+            {"name": "content", "type": content_type},
+        ]
+        self.executed = []
+
+    def execute(self, statement) -> None:
+        self.executed.append(str(statement))
+
+
+def _fake_inspect(connection):
+    return SimpleNamespace(get_columns=lambda table: connection.columns)
+
+
+@pytest.mark.parametrize("content_type", [postgresql.JSON(), postgresql.JSONB()])
+def test_json_content_column_is_migrated_to_text_on_postgres(monkeypatch, content_type):
+    connection = FakeConnection("postgresql", content_type)
+    monkeypatch.setattr(db, "inspect", _fake_inspect)
+
+    db._migrate_message_content(connection)
+
+    assert connection.executed == [
+        "ALTER TABLE messages ALTER COLUMN content TYPE text USING content::text"
+    ]
+
+
+@pytest.mark.parametrize(
+    ("dialect_name", "content_type"), [("postgresql", Text()), ("sqlite", JSON())]
+)
+def test_content_column_is_left_alone_otherwise(
+    monkeypatch, dialect_name, content_type
+):
+    connection = FakeConnection(dialect_name, content_type)
+    monkeypatch.setattr(db, "inspect", _fake_inspect)
+
+    db._migrate_message_content(connection)
+
+    assert connection.executed == []
+
+
+async def test_orjson_text_round_trip(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+    content = {
+        "id": "m1",
+        "role": "assistant",
+        "content": [{"type": "text", "text": "é"}],
+    }
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+        await conn.execute(
+            sessions_table.insert().values(
+                id="s1",
+                model="model",
+                tool_version="computer_use_20250124",
+                system_prompt_suffix="",
+                created_at=NOW,
+                updated_at=NOW,
+            )
+        )
+        await conn.execute(
+            messages_table.insert().values(
+                id="m1",
+                session_id="s1",
+                role="assistant",
+                content=content,
+                created_at=NOW,
+            )
+        )
+        stored = (await conn.execute(select(messages_table.c.content))).scalar_one()
+    await engine.dispose()
+
+    assert isinstance(stored, str)
+    assert orjson.loads(stored) == content
+
+
+async def test_messages_written_back_to_back_keep_their_order(database):
+    await db.create_session("s1", "model", "computer_use_20250124", "")
+    for i in range(20):
+        await db.upsert_message(f"m{i}", "s1", "user", {"i": i})
+
+    rows = [row async for row in db.get_messages("s1")]
+
+    assert [row["id"] for row in rows] == [f"m{i}" for i in range(20)]
+    assert len({row["created_at"] for row in rows}) == 20
+
+
+async def test_bulk_upsert_messages_writes_rows_and_touches_session(database):
+    await db.create_session("s1", "model", "computer_use_20250124", "")
+    before = (await db.get_session("s1"))["updated_at"]
+    rows = [
+        {
+            "id": f"m{i}",
+            "session_id": "s1",
+            "role": "tool",
+            "content": {"i": i},
+            "created_at": NOW + timedelta(seconds=i),
+        }
+        for i in range(3)
+    ]
+
+    await db.bulk_upsert_messages(rows, "s1")
+
+    stored = [row async for row in db.get_messages("s1")]
+    assert [row["id"] for row in stored] == ["m0", "m1", "m2"]
+    assert [orjson.loads(row["content"]) for row in stored] == [
+        {"i": i} for i in range(3)
+    ]
+    assert (await db.get_session("s1"))["updated_at"] >= before
+
+
+async def test_failed_turn_still_flushes_its_tool_messages(database, monkeypatch):
+    await db.create_session("s1", "model", "computer_use_20250124", "")
+
+    async def failing_sampling_loop(*, tool_output_callback, **kwargs):
+        tool_output_callback(ToolResult(output="file.txt"), "t1")
+        raise RuntimeError("API error")
+
+    monkeypatch.setattr(agent_runner, "sampling_loop", failing_sampling_loop)
+    runner = AgentSession(
+        session_id="s1",
+        model="model",
+        tool_version="computer_use_20250124",
+        api_key="test-key",
+    )
+
+    with pytest.raises(RuntimeError, match="API error"):
+        await runner.run_once()
+
+    stored = [row async for row in db.get_messages("s1")]
+    assert [row["role"] for row in stored] == ["tool"]
+    assert orjson.loads(stored[0]["content"])["content"][0]["output"] == "file.txt"
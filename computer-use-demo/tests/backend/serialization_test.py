@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import msgpack
+import orjson
+from pydantic import BaseModel
+
+from backend.app.serialization import dumps, pack_frame
+
+
+class Block(BaseModel):
+    type: str
+    text: str
+
+
+def test_pack_frame_prefixes_payload_with_big_endian_length():
+    frame = pack_frame({"event": "message", "data": {"n": 1}})
+
+    length = int.from_bytes(frame[:4], "big")
+    assert length == len(frame) - 4
+    assert msgpack.unpackb(frame[4:]) == {"event": "message", "data": {"n": 1}}
+
+
+def test_pack_frame_keeps_bytes_binary():
+    image = b"\x89PNG\r\n\x1a\n\x00\xff"
+
+    payload = msgpack.unpackb(pack_frame({"image": image})[4:])
+
+    assert payload["image"] == image
+
+
+def test_pack_frame_encodes_datetimes_and_models():
+    when = datetime(2025, 1, 2, 3, 4, 5)
+
+    payload = msgpack.unpackb(
+        pack_frame({"at": when, "block": Block(type="text", text="hi")})[4:]
+    )
+
+    assert payload == {
+        "at": "2025-01-02T03:04:05",
+        "block": {"type": "text", "text": "hi"},
+    }
+
+
+def test_dumps_falls_back_for_bytes_and_models():
+    encoded = orjson.loads(dumps({"raw": b"hi", "block": Block(type="text", text="x")}))
+
+    assert encoded == {"raw": "aGk=", "block": {"type": "text", "text": "x"}}
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from backend.app import session_cache
+from backend.app.session_cache import SessionCache, session_lock
+from backend.app.settings import get_max_active_sessions
+
+
+class FakeRunner:
+    def __init__(self, in_use: bool = False) -> None:
+        self.in_use = in_use
+        self.closed = False
+
+    async def persist_and_close(self) -> None:
+        self.closed = True
+
+
+async def test_put_evicts_least_recently_used():
+    cache = SessionCache(maxsize=2)
+    a, b, c = FakeRunner(), FakeRunner(), FakeRunner()
+    await cache.put("a", a)
+    await cache.put("b", b)
+    assert cache.get("a") is a  # a is now more recent than b
+
+    await cache.put("c", c)
+
+    assert "b" not in cache
+    assert b.closed
+    assert cache.get("a") is a and cache.get("c") is c
+    assert not a.closed and not c.closed
+
+
+async def test_put_skips_runners_in_use():
+    cache = SessionCache(maxsize=1)
+    busy, idle = FakeRunner(in_use=True), FakeRunner()
+    await cache.put("busy", busy)
+    await cache.put("idle", idle)
+
+    # Nothing idle to evict except the runner just inserted
+    assert len(cache) == 2
+    assert not busy.closed and not idle.closed
+
+    busy.in_use = False
+    newest = FakeRunner()
+    await cache.put("newest", newest)
+
+    assert "newest" in cache
+    assert len(cache) == 1
+    assert busy.closed and idle.closed
+
+
+async def test_put_never_evicts_the_inserted_runner():
+    cache = SessionCache(maxsize=1)
+    runner = FakeRunner()
+    await cache.put("a", runner)
+    await cache.put("a", runner)
+
+    assert cache.get("a") is runner
+    assert not runner.closed
+
+
+async def test_session_lock_is_shared_while_referenced():
+    lock = session_lock("s")
+
+    assert session_lock("s") is lock
+    assert isinstance(lock, asyncio.Lock)
+
+    del lock
+    assert "s" not in session_cache._LOCKS
+
+
+@pytest.mark.parametrize("value", ["0", "-1"])
+def test_max_active_sessions_must_be_positive(monkeypatch, value):
+    monkeypatch.setenv("MAX_ACTIVE_SESSIONS", value)
+    with pytest.raises(ValueError):
+        get_max_active_sessions()